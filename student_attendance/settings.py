@@ -3,6 +3,7 @@ Django settings for student attendance project.
 """
 
 import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -39,6 +40,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'student_attendance_interfaces.middleware.TeacherMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -116,11 +118,67 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Cache
+# Known face encodings are invalidated through the cache, so it must be shared by
+# every worker process. The default file-based cache covers workers on one host,
+# multi-host deployments should point MEMCACHED_LOCATION at a Memcached server.
+# A per-process LocMemCache is only safe with a single worker.
+
+if os.environ.get('MEMCACHED_LOCATION'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+            'LOCATION': os.environ['MEMCACHED_LOCATION'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get(
+                'DJANGO_CACHE_DIR',
+                os.path.join(tempfile.gettempdir(), 'student_attendance_cache')
+            ),
+            'OPTIONS': {
+                'MAX_ENTRIES': 5000,
+            },
+        }
+    }
+
+# Persisted face recognition indexes
+FACE_INDEX_DIR = os.path.join(BASE_DIR, 'face_index')
+
+# Face detector: 'cnn' (needs dlib built with -DDLIB_USE_CUDA=1) or 'hog'.
+# None picks 'cnn' on CUDA builds, otherwise MediaPipe BlazeFace if installed, else 'hog'
+FACE_DETECTION_MODEL = None
+
+# Logging
+# App debug messages are only emitted while DEBUG is on
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'student_attendance_interfaces': {
+            'handlers': ['console'],
+            'level': 'DEBUG' if DEBUG else 'INFO',
+        },
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Covering index INCLUDE columns are only used on PostgreSQL, other backends ignore them
+SILENCED_SYSTEM_CHECKS = ['models.W040']
+
 # Login URL
 LOGIN_URL = 'teacher_login'
 LOGIN_REDIRECT_URL = 'attendance_dashboard'
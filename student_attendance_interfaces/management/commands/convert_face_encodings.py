@@ -0,0 +1,42 @@
+import pickle
+import numpy as np
+from django.core.management.base import BaseCommand
+from ...models import FaceImage
+from ...services.face_index import ENCODING_DIM, ENCODING_BYTES, encoding_to_bytes
+
+
+def decode_legacy_encoding(encoding):
+    """Decode an encoding stored as raw float32 bytes or as a pickled array"""
+    if len(encoding) == ENCODING_DIM * 4:
+        return np.frombuffer(encoding, dtype=np.float32)
+    return pickle.loads(encoding)
+
+
+class Command(BaseCommand):
+    help = "Convert pickled or float32 face encodings to the current storage format"
+
+    def handle(self, *args, **options):
+        converted = 0
+        failed = 0
+
+        face_images = FaceImage.objects.filter(face_encoding__isnull=False).only('id', 'face_encoding')
+
+        for face_image in face_images.iterator():
+            encoding = bytes(face_image.face_encoding)
+            if len(encoding) == ENCODING_BYTES:
+                continue
+
+            try:
+                FaceImage.objects.filter(pk=face_image.pk).update(
+                    face_encoding=encoding_to_bytes(decode_legacy_encoding(encoding))
+                )
+                converted += 1
+            except Exception as e:
+                self.stderr.write(f"Could not convert face image {face_image.id}: {str(e)}")
+                failed += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Converted {converted} face encodings ({failed} failed)"))
+        # update() skips the FaceImage signals, so tell running workers to reload
+        if converted:
+            from ...services.face_recognition_service import FaceRecognitionService
+            FaceRecognitionService.invalidate_known_faces()
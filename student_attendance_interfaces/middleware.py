@@ -0,0 +1,26 @@
+from django.utils.functional import SimpleLazyObject
+from .models import Teacher
+
+
+def get_teacher(user):
+    """
+    Look up the active teacher profile for a user
+    Returns: Teacher or None for anonymous users and non-teachers
+    """
+    if not user.is_authenticated:
+        return None
+    return Teacher.objects.select_related('user').filter(user=user, is_active=True).first()
+
+
+class TeacherMiddleware:
+    """
+    Attach the logged-in teacher to request.teacher
+    The lookup is lazy, so requests that never read it don't pay for the query
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.teacher = SimpleLazyObject(lambda: get_teacher(request.user))
+        return self.get_response(request)
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-15 10:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("student_attendance_interfaces", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="faceimage",
+            name="face_images_student_429d33_idx",
+        ),
+        migrations.AddIndex(
+            model_name="faceimage",
+            index=models.Index(
+                fields=["student", "angle", "is_active", "-captured_at"],
+                include=("image", "face_encoding"),
+                name="fi_lookup_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,43 @@
+import pickle
+
+import numpy as np
+from django.db import migrations
+
+ENCODING_DIM = 128
+
+
+def convert_face_encodings(apps, schema_editor):
+    """Rewrite pickled and float32 face encodings as raw float16 bytes"""
+    FaceImage = apps.get_model("student_attendance_interfaces", "FaceImage")
+
+    face_images = FaceImage.objects.filter(face_encoding__isnull=False).only(
+        "id", "face_encoding"
+    )
+    for face_image in face_images.iterator():
+        encoding = bytes(face_image.face_encoding)
+        if len(encoding) == ENCODING_DIM * 2:
+            continue
+
+        try:
+            if len(encoding) == ENCODING_DIM * 4:
+                array = np.frombuffer(encoding, dtype=np.float32)
+            else:
+                array = pickle.loads(encoding)
+            array = np.asarray(array, dtype=np.float16).reshape(ENCODING_DIM)
+        except Exception:
+            # Unreadable legacy row: leave it as is, the loader skips blobs of the
+            # wrong length and convert_face_encodings reports it as a failure
+            continue
+
+        FaceImage.objects.filter(pk=face_image.pk).update(face_encoding=array.tobytes())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("student_attendance_interfaces", "0002_faceimage_fi_lookup_idx"),
+    ]
+
+    operations = [
+        migrations.RunPython(convert_face_encodings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-15 10:10
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_total_students(apps, schema_editor):
+    """Set total_students on existing sessions from their session logs"""
+    AttendanceSession = apps.get_model(
+        "student_attendance_interfaces", "AttendanceSession"
+    )
+    SessionLog = apps.get_model("student_attendance_interfaces", "SessionLog")
+
+    log_counts = (
+        SessionLog.objects.filter(session=OuterRef("pk"))
+        .order_by()
+        .values("session")
+        .annotate(total=Count("id"))
+        .values("total")
+    )
+    AttendanceSession.objects.update(total_students=Coalesce(Subquery(log_counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("student_attendance_interfaces", "0003_convert_face_encodings"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="attendancesession",
+            name="total_students",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_total_students, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-15 10:14
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("student_attendance_interfaces", "0004_attendancesession_total_students"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="sessionlog",
+            name="session_log_session_a23cff_idx",
+        ),
+        migrations.AddIndex(
+            model_name="attendancesession",
+            index=models.Index(
+                fields=["status", "start_time", "end_time"],
+                name="attendance__status_a315c4_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="sessionlog",
+            index=models.Index(
+                fields=["session", "status", "recognized_at"],
+                name="session_log_session_2646e0_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="student",
+            index=models.Index(
+                fields=["is_active", "course"], name="students_is_acti_852c85_idx"
+            ),
+        ),
+    ]
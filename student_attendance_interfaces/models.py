@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import Count, Q
 from django.contrib.auth.models import User
 from django.utils import timezone
 import os
@@ -51,6 +52,9 @@ class Student(models.Model):
     class Meta:
         db_table = 'students'
         ordering = ['course', 'last_name', 'first_name']
+        indexes = [
+            models.Index(fields=['is_active', 'course']),
+        ]
 
     def __str__(self):
         return f"{self.student_id} - {self.first_name} {self.last_name} ({self.course.code})"
@@ -65,11 +69,19 @@ class Student(models.Model):
 
     def get_all_angles(self):
         """Get all angle images for verification"""
-        return {
-            'front': self.face_images.filter(angle='front', is_active=True).order_by('-captured_at').first(),
-            'left': self.face_images.filter(angle='left', is_active=True).order_by('-captured_at').first(),
-            'right': self.face_images.filter(angle='right', is_active=True).order_by('-captured_at').first()
-        }
+        angle_images = {'front': None, 'left': None, 'right': None}
+        
+        # One query for all angles, newest first within each angle
+        face_images = self.face_images.filter(
+            is_active=True,
+            angle__in=angle_images.keys()
+        ).order_by('angle', '-captured_at')
+        
+        for face_image in face_images:
+            if angle_images[face_image.angle] is None:
+                angle_images[face_image.angle] = face_image
+        
+        return angle_images
 
 
 class FaceImage(models.Model):
@@ -92,7 +104,12 @@ class FaceImage(models.Model):
         db_table = 'face_images'
         ordering = ['-captured_at']
         indexes = [
-            models.Index(fields=['student', 'angle', 'is_active']),
+            # Covering index for latest-image-per-angle lookups (INCLUDE is PostgreSQL only)
+            models.Index(
+                fields=['student', 'angle', 'is_active', '-captured_at'],
+                name='fi_lookup_idx',
+                include=['image', 'face_encoding']
+            ),
             models.Index(fields=['angle']),
         ]
 
@@ -100,6 +117,9 @@ class FaceImage(models.Model):
         return f"{self.student.student_id} - {self.angle} - {self.captured_at}"
 
 
+RECENT_SESSIONS_CACHE_KEY = 'recent_sessions_v1'
+
+
 class AttendanceSession(models.Model):
     """Track attendance sessions"""
     SESSION_STATUS = [
@@ -116,12 +136,16 @@ class AttendanceSession(models.Model):
     end_time = models.DateTimeField()
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='sessions_created')
     status = models.CharField(max_length=20, choices=SESSION_STATUS, default='active')
+    total_students = models.PositiveIntegerField(default=0)  # Enrolled students when the session was created
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         db_table = 'attendance_sessions'
         ordering = ['-session_date', '-start_time']
+        indexes = [
+            models.Index(fields=['status', 'start_time', 'end_time']),
+        ]
 
     def __str__(self):
         return f"{self.session_name} - {self.course.code} - {self.session_date}"
@@ -133,9 +157,18 @@ class AttendanceSession(models.Model):
 
     def get_attendance_statistics(self):
         """Calculate attendance statistics for this session"""
-        total_students = Student.objects.filter(is_active=True, course=self.course).count()
-        present_count = self.session_logs.filter(status='present').count()
-        absent_count = total_students - present_count
+        counts = self.session_logs.aggregate(
+            present=Count('id', filter=Q(status='present')),
+            absent=Count('id', filter=Q(status='absent')),
+            total=Count('id')
+        )
+        present_count = counts['present']
+        absent_count = counts['absent']
+        total_students = counts['total']
+        if total_students == 0:
+            # Logs were never initialized for this session, fall back to the stored total
+            total_students = self.total_students or self.course.students.filter(is_active=True).count()
+            absent_count = total_students
         
         return {
             'total_students': total_students,
@@ -167,7 +200,7 @@ class SessionLog(models.Model):
         unique_together = ['session', 'student']
         ordering = ['-recognized_at']
         indexes = [
-            models.Index(fields=['session', 'status']),
+            models.Index(fields=['session', 'status', 'recognized_at']),
             models.Index(fields=['student', 'session']),
         ]
 
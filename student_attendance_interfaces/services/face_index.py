@@ -0,0 +1,154 @@
+import os
+import threading
+import numpy as np
+
+try:
+    import faiss
+except ImportError:  # FAISS is optional, fall back to a Numba or NumPy scan
+    faiss = None
+
+try:
+    import numba
+except ImportError:  # Numba is optional, fall back to a NumPy scan
+    numba = None
+
+ENCODING_DIM = 128
+ENCODING_DTYPE = np.float16  # Storage precision, search always runs in float32
+ENCODING_BYTES = ENCODING_DIM * np.dtype(ENCODING_DTYPE).itemsize
+IVF_MIN_SIZE = 10000  # Switch from exact to inverted-file search above this size
+IVFPQ_MIN_SIZE = 50000  # Also compress vectors with product quantization above this size
+
+# Numba's workqueue threading layer aborts the process on concurrent parallel calls,
+# and stream workers and request threads search at the same time. Each call already
+# uses every core, so serializing them costs little.
+_numba_lock = threading.Lock()
+
+
+if numba is not None:
+    @numba.njit(parallel=True, fastmath=True, cache=True)
+    def _nearest_l2(known, queries):
+        """Fused squared-distance and argmin scan, parallel over the known encodings"""
+        distances = np.empty(queries.shape[0], dtype=np.float32)
+        indices = np.empty(queries.shape[0], dtype=np.int64)
+        squared = np.empty(known.shape[0], dtype=np.float32)
+
+        for q in range(queries.shape[0]):
+            for i in numba.prange(known.shape[0]):
+                total = 0.0
+                for j in range(known.shape[1]):
+                    diff = known[i, j] - queries[q, j]
+                    total += diff * diff
+                squared[i] = total
+
+            best = np.argmin(squared)
+            indices[q] = best
+            distances[q] = np.sqrt(squared[best])
+
+        return distances, indices
+
+
+def encoding_to_bytes(encoding):
+    """Serialize a face encoding for storage in FaceImage.face_encoding"""
+    return np.asarray(encoding, dtype=ENCODING_DTYPE).tobytes()
+
+
+def encodings_from_bytes(blobs):
+    """Deserialize stored face encodings into a single (N, 128) matrix"""
+    matrix = np.frombuffer(b''.join(blobs), dtype=ENCODING_DTYPE).reshape(-1, ENCODING_DIM)
+    return matrix.astype(np.float32)
+
+
+class FaceIndex:
+    """Nearest-neighbour search over known face encodings"""
+
+    def __init__(self, encodings):
+        self.encodings = np.ascontiguousarray(
+            np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        )
+        self.index = None
+
+        if faiss is not None and len(self.encodings) > 0:
+            self.index = self._build_faiss_index(self.encodings)
+        elif numba is None:
+            # Squared norms for the matrix-product form of the L2 distance
+            self.squared_norms = np.einsum('ij,ij->i', self.encodings, self.encodings)
+
+    def __len__(self):
+        if self.index is not None:
+            return self.index.ntotal
+        return len(self.encodings)
+
+    @classmethod
+    def read(cls, path):
+        """
+        Load a FAISS index written by write(), memory-mapped where FAISS supports it
+        Returns: FaceIndex or None if FAISS is unavailable or the file is missing
+        """
+        if faiss is None or not os.path.exists(path):
+            return None
+
+        face_index = cls(np.empty((0, ENCODING_DIM), dtype=np.float32))
+        try:
+            face_index.index = faiss.read_index(path, faiss.IO_FLAG_MMAP)
+        except RuntimeError:
+            # Not every index type can be memory-mapped
+            face_index.index = faiss.read_index(path)
+        return face_index
+
+    def write(self, path):
+        """
+        Write the FAISS index to disk, atomically replacing any existing file
+        Returns: True if the index was written
+        """
+        if self.index is None:
+            return False
+
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        faiss.write_index(self.index, temp_path)
+        os.replace(temp_path, path)
+        return True
+
+    def _build_faiss_index(self, matrix):
+        """
+        Build a FAISS L2 index over the encodings
+        Uses an exact flat index, then IVF and IVF-PQ as enrollment grows
+        """
+        if len(matrix) >= IVFPQ_MIN_SIZE:
+            # 16 bytes per vector instead of 512
+            quantizer = faiss.IndexFlatL2(ENCODING_DIM)
+            index = faiss.IndexIVFPQ(quantizer, ENCODING_DIM, 256, 16, 8)
+            index.train(matrix)
+            index.nprobe = 16
+        elif len(matrix) >= IVF_MIN_SIZE:
+            index = faiss.index_factory(ENCODING_DIM, "IVF100,Flat", faiss.METRIC_L2)
+            index.train(matrix)
+            index.nprobe = 8
+        else:
+            index = faiss.IndexFlatL2(ENCODING_DIM)
+
+        index.add(matrix)
+        return index
+
+    def search(self, queries):
+        """
+        Find the closest known encoding for each query encoding
+        Returns: tuple of (distances, indices) arrays, one entry per query
+        """
+        queries = np.ascontiguousarray(
+            np.asarray(queries, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        )
+
+        if self.index is not None:
+            # FAISS reports squared L2 distances
+            distances, indices = self.index.search(queries, 1)
+            return np.sqrt(np.maximum(distances[:, 0], 0)), indices[:, 0]
+
+        if numba is not None:
+            with _numba_lock:
+                return _nearest_l2(self.encodings, queries)
+
+        # |k - q|^2 = |k|^2 - 2 k.q + |q|^2, one GEMM instead of an (M, N, 128) temporary
+        squared = self.squared_norms[np.newaxis, :] - 2 * (queries @ self.encodings.T)
+        indices = np.argmin(squared, axis=1)
+        best = squared[np.arange(len(queries)), indices] + np.einsum('ij,ij->i', queries, queries)
+        return np.sqrt(np.maximum(best, 0)), indices
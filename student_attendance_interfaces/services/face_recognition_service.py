@@ -1,27 +1,96 @@
+import dlib
 import face_recognition
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-import pickle
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
 from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from django.db.models import Count, Max
 from django.utils import timezone
-from ..models import Student, FaceImage, AttendanceSession, SessionLog
+from ..models import Course, Student, FaceImage, AttendanceSession, SessionLog
+from .face_index import FaceIndex, ENCODING_BYTES, encoding_to_bytes, encodings_from_bytes
 import cv2
+import glob
+import hashlib
+import os
+import queue
+import threading
+import time
+import uuid
 from io import BytesIO
 from PIL import Image
 
+try:
+    import mediapipe as mp
+except ImportError:  # MediaPipe is optional, fall back to dlib HOG detection
+    mp = None
+
+try:
+    from turbojpeg import TurboJPEG
+    turbo_jpeg = TurboJPEG()
+except (ImportError, OSError, RuntimeError):  # PyTurboJPEG or libjpeg-turbo missing, use OpenCV
+    turbo_jpeg = None
+
 class FaceRecognitionService:
     """Service for handling face recognition operations"""
     
+    # (version, known faces) per course code (None for all courses), shared by all instances
+    _encoding_cache = {}
+    _cache_lock = threading.Lock()
+    
+    # (version, {student_id: full name}) per course code, versioned like _encoding_cache
+    _names_cache = {}
+    
+    # Workers encoding the three enrollment angles concurrently, dlib releases the GIL
+    _encode_pool = ThreadPoolExecutor(max_workers=3, thread_name_prefix='face-encode')
+    
+    # Background workers for JPEG encoding and storage of recognized frames
+    _io_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='face-io')
+    
+    # Background workers running process_video_stream, and their futures keyed by session id
+    _stream_workers = 4
+    _stream_pool = ThreadPoolExecutor(max_workers=_stream_workers, thread_name_prefix='face-stream')
+    _streams = {}
+    _streams_lock = threading.Lock()
+    
+    # Stop events for running video streams, keyed by session id
+    _stop_events = {}
+    
     def __init__(self):
         self.tolerance = 0.6  # Adjust for recognition sensitivity
-        self.model = 'hog'  # Use 'cnn' for better accuracy but slower performance
+        # dlib's CNN detector is only practical on a CUDA-enabled dlib build,
+        # settings.FACE_DETECTION_MODEL ('cnn' or 'hog') overrides the probe
+        configured_model = getattr(settings, 'FACE_DETECTION_MODEL', None)
+        self.model = configured_model or ('cnn' if dlib.DLIB_USE_CUDA else 'hog')
+        self.batch_size = 16  # Video frames per batched CNN detection call
+        self.frame_stride = 5  # Only run recognition on every Nth video frame
+        self.detect_scale = 0.25  # Downscale video frames by this factor for detection
+        self.jpeg_quality = 85  # Quality of saved recognition snapshots
+        self.motion_threshold = 2.0  # Mean grey-level change needed to run detection on a video frame
+        self.max_batch_delay = 1.0  # Seconds a partial batch of video frames may wait before recognition
+        
+        # Without CUDA, MediaPipe BlazeFace is much faster than HOG on CPU.
+        # Only picked automatically, an explicit 'hog' setting keeps dlib's HOG detector.
+        self._face_detection = None
+        self._face_detection_lock = threading.Lock()  # MediaPipe graphs are not thread-safe
+        if configured_model is None and self.model == 'hog' and mp is not None:
+            self._face_detection = mp.solutions.face_detection.FaceDetection(
+                model_selection=1,
+                min_detection_confidence=0.5
+            )
     
-    def encode_face(self, image_path):
+    def encode_face(self, image):
         """
         Generate face encoding from an image
+        image: RGB numpy array, or a path/file-like object to load it from
         Returns: numpy array of face encoding or None
         """
         try:
-            image = face_recognition.load_image_file(image_path)
+            if not isinstance(image, np.ndarray):
+                image = face_recognition.load_image_file(image)
             face_encodings = face_recognition.face_encodings(image)
             
             if len(face_encodings) > 0:
@@ -31,6 +100,15 @@ class FaceRecognitionService:
             print(f"Error encoding face: {str(e)}")
             return None
     
+    def _encode_upload(self, image_file):
+        """
+        Decode an uploaded image in memory and encode its face
+        Returns: numpy array of face encoding or None
+        """
+        image_file.seek(0)
+        image = np.asarray(Image.open(image_file).convert('RGB'))
+        return self.encode_face(image)
+    
     def save_student_face_images(self, student, front_image, left_image, right_image):
         """
         Save all three angle images for a student
@@ -44,29 +122,47 @@ class FaceRecognitionService:
             'right': right_image
         }
         
-        for angle, image_file in images_data.items():
+        futures = {
+            angle: self._encode_pool.submit(self._encode_upload, image_file)
+            for angle, image_file in images_data.items()
+        }
+        
+        face_images = []
+        for angle, future in futures.items():
             try:
-                # Create FaceImage object
-                face_image = FaceImage.objects.create(
-                    student=student,
-                    angle=angle,
-                    image=image_file
-                )
-                
-                # Generate and store face encoding
-                encoding = self.encode_face(face_image.image.path)
-                if encoding is not None:
-                    face_image.face_encoding = pickle.dumps(encoding)
-                    face_image.save()
-                    results['images'][angle] = face_image
-                else:
-                    results['errors'].append(f"No face detected in {angle} image")
-                    face_image.delete()
-                    results['success'] = False
-                    
+                encoding = future.result()
             except Exception as e:
                 results['errors'].append(f"Error saving {angle} image: {str(e)}")
                 results['success'] = False
+                continue
+            
+            if encoding is None:
+                results['errors'].append(f"No face detected in {angle} image")
+                results['success'] = False
+                continue
+            
+            image_file = images_data[angle]
+            image_file.seek(0)
+            face_images.append(FaceImage(
+                student=student,
+                angle=angle,
+                image=image_file,
+                face_encoding=encoding_to_bytes(encoding)
+            ))
+        
+        if face_images:
+            try:
+                # One INSERT for every angle with a detected face
+                with transaction.atomic():
+                    FaceImage.objects.bulk_create(face_images)
+            except Exception as e:
+                results['errors'].append(f"Error saving face images: {str(e)}")
+                results['success'] = False
+                return results
+            
+            results['images'] = {face_image.angle: face_image for face_image in face_images}
+            # bulk_create skips post_save, so the signal handler never sees these rows
+            self.invalidate_known_faces(student.course_id)
         
         return results
     
@@ -74,123 +170,447 @@ class FaceRecognitionService:
         """
         Load all active student face encodings
         If course is provided, only load students from that course
-        Returns: tuple of (encodings list, student_ids list)
+        Returns: tuple of (FaceIndex, student_ids list)
+        """
+        cache_key = course.code if course else None
+        
+        # The shared version changes when any worker invalidates this course
+        version = self._known_faces_version(cache_key)
+        cached = self._encoding_cache.get(cache_key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        
+        # Let one thread build a course's index while concurrent requests wait for it
+        with self._cache_lock:
+            cached = self._encoding_cache.get(cache_key)
+            if cached is None or cached[0] != version:
+                cached = (version, self._build_known_faces(course, version))
+                self._encoding_cache[cache_key] = cached
+            return cached[1]
+    
+    def known_student_names(self, course=None):
+        """
+        Full names of the active students known_faces are loaded for
+        Shares load_known_faces' cache version, so it is dropped by the same invalidation
+        Returns: dict of student_id -> full name
+        """
+        cache_key = course.code if course else None
+        
+        version = self._known_faces_version(cache_key)
+        cached = self._names_cache.get(cache_key)
+        if cached is None or cached[0] != version:
+            students = Student.objects.filter(is_active=True)
+            if course:
+                students = students.filter(course=course)
+            names = {
+                student_id: f"{first_name} {last_name}"
+                for student_id, first_name, last_name in students.values_list('student_id', 'first_name', 'last_name')
+            }
+            cached = (version, names)
+            self._names_cache[cache_key] = cached
+        return cached[1]
+    
+    @staticmethod
+    def _known_faces_version(cache_key):
+        """Current shared cache version of a course's known faces"""
+        return cache.get_or_set(f"known_faces_version:{cache_key or 'all'}", lambda: uuid.uuid4().hex, None)
+    
+    def _build_known_faces(self, course=None, version=None):
+        """
+        Build the FaceIndex for a course from disk, the shared cache or the database
+        version: the course's current _known_faces_version, looked up if not given
+        Returns: tuple of (FaceIndex, student_ids list)
         """
-        known_encodings = []
-        known_student_ids = []
+        cache_key = course.code if course else None
+        if version is None:
+            version = self._known_faces_version(cache_key)
         
         # Get all active students with front face images
         query = FaceImage.objects.filter(
             angle='front',
             is_active=True,
-            student__is_active=True
+            student__is_active=True,
+            face_encoding__isnull=False
         )
         
         # Filter by course if provided
         if course:
             query = query.filter(student__course=course)
         
-        face_images = query.select_related('student')
+        # Reuse the index persisted since the last invalidation, if any
+        stats = query.aggregate(latest=Max('captured_at'), total=Count('id'))
+        index_prefix = self._index_prefix(cache_key, version, stats)
+        index_path, ids_path = f"{index_prefix}.faiss", f"{index_prefix}.npy"
         
-        for face_img in face_images:
-            if face_img.face_encoding:
+        # Index files are named after the cache version, which other workers and
+        # restarts only see when the cache is shared between processes
+        persist_index = self._cache_is_shared()
+        
+        face_index = FaceIndex.read(index_path) if persist_index else None
+        if face_index is not None and os.path.exists(ids_path):
+            return face_index, np.load(ids_path).tolist()
+        
+        # Other workers may already have read the same encodings since the last invalidation
+        payload_key = f"known_faces:{os.path.basename(index_prefix)}"
+        payload = cache.get(payload_key)
+        if payload is not None:
+            encoding_data, known_student_ids = payload
+        else:
+            known_student_ids = []
+            blobs = []
+            for student_id, face_encoding in query.values_list('student_id', 'face_encoding'):
+                if len(face_encoding) != ENCODING_BYTES:
+                    print(f"Skipping unconverted encoding for {student_id}, run convert_face_encodings")
+                    continue
+                known_student_ids.append(student_id)
+                blobs.append(face_encoding)
+            
+            # Cache the compact stored bytes rather than the decoded float32 matrix
+            encoding_data = b''.join(blobs)
+            try:
+                cache.set(payload_key, (encoding_data, known_student_ids), 3600)
+            except Exception as e:
+                print(f"Error caching known faces: {str(e)}")
+        
+        face_index = FaceIndex(encodings_from_bytes([encoding_data]))
+        if persist_index and face_index.index is not None:
+            try:
+                os.makedirs(settings.FACE_INDEX_DIR, exist_ok=True)
+                # Student ids first, so an index file never exists without them
+                temp_ids_path = f"{index_prefix}.{os.getpid()}.tmp.npy"
+                np.save(temp_ids_path, np.array(known_student_ids))
+                os.replace(temp_ids_path, ids_path)
+                face_index.write(index_path)
+            except OSError as e:
+                print(f"Error persisting face index: {str(e)}")
+        
+        return face_index, known_student_ids
+    
+    @staticmethod
+    def _cache_is_shared():
+        """Whether the default cache is visible to other worker processes and survives restarts"""
+        return not isinstance(caches['default'], (LocMemCache, DummyCache))
+    
+    @staticmethod
+    def _index_prefix(cache_key, version, stats):
+        """
+        Build the on-disk path prefix for a course's persisted index and student ids
+        The name changes with every invalidation of the course, and also when face
+        images are added or removed without one (e.g. bulk updates that skip signals)
+        """
+        digest = hashlib.sha1(f"{version}:{stats['latest']}:{stats['total']}".encode()).hexdigest()[:16]
+        return os.path.join(settings.FACE_INDEX_DIR, f"{cache_key or 'all'}_{digest}")
+    
+    @classmethod
+    def invalidate_known_faces(cls, course_code=None):
+        """
+        Drop cached encodings and persisted indexes for a course (and the all-courses entry)
+        If course_code is None, drop every cached entry
+        Bumping the shared version makes other workers reload on their next call
+        """
+        if course_code is None:
+            cls._encoding_cache.clear()
+            cache_keys = [code for code, _ in Course.COURSE_CHOICES] + [None]
+            patterns = ['*']
+        else:
+            cls._encoding_cache.pop(course_code, None)
+            cls._encoding_cache.pop(None, None)
+            cache_keys = [course_code, None]
+            patterns = [f'{course_code}_*', 'all_*']
+        
+        cache.set_many({f"known_faces_version:{key or 'all'}": uuid.uuid4().hex for key in cache_keys}, None)
+        
+        for pattern in patterns:
+            for path in glob.glob(os.path.join(settings.FACE_INDEX_DIR, pattern)):
                 try:
-                    encoding = pickle.loads(face_img.face_encoding)
-                    known_encodings.append(encoding)
-                    known_student_ids.append(face_img.student.student_id)
-                except Exception as e:
-                    print(f"Error loading encoding for {face_img.student.student_id}: {str(e)}")
+                    os.remove(path)
+                except OSError:
+                    pass
+    
+    def _to_rgb(self, frame):
+        """Convert a BGR frame to RGB, through OpenCL when OpenCV has a device for it"""
+        if cv2.ocl.haveOpenCL():
+            return cv2.cvtColor(cv2.UMat(frame), cv2.COLOR_BGR2RGB).get()
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    
+    def _blazeface_locations(self, rgb_frame):
+        """
+        Detect faces with MediaPipe BlazeFace
+        Returns: list of (top, right, bottom, left) tuples
+        """
+        height, width = rgb_frame.shape[:2]
+        with self._face_detection_lock:
+            results = self._face_detection.process(rgb_frame)
         
-        return known_encodings, known_student_ids
+        face_locations = []
+        for detection in results.detections or []:
+            box = detection.location_data.relative_bounding_box
+            face_locations.append((
+                max(int(box.ymin * height), 0),
+                min(int((box.xmin + box.width) * width), width),
+                min(int((box.ymin + box.height) * height), height),
+                max(int(box.xmin * width), 0)
+            ))
+        return face_locations
     
-    def recognize_face_from_frame(self, frame, known_encodings, known_student_ids):
+    def locate_faces_in_frames(self, rgb_frames, scale=1.0):
+        """
+        Detect faces in one or more frames, optionally on downscaled copies
+        Several frames are detected in one batched call when using the CNN model
+        Returns: list of (top, right, bottom, left) tuple lists in full-frame coordinates, one per frame
         """
-        Recognize face from a video frame
-        Returns: tuple of (student_id, confidence_score) or (None, None)
+        if scale < 1:
+            detect_frames = [
+                cv2.resize(rgb_frame, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+                for rgb_frame in rgb_frames
+            ]
+        else:
+            detect_frames = rgb_frames
+        
+        if self.model == 'cnn' and len(detect_frames) > 1:
+            batched_locations = face_recognition.batch_face_locations(
+                detect_frames,
+                number_of_times_to_upsample=0,
+                batch_size=len(detect_frames)
+            )
+        elif self._face_detection is not None:
+            batched_locations = [self._blazeface_locations(frame) for frame in detect_frames]
+        else:
+            batched_locations = [
+                face_recognition.face_locations(frame, model=self.model) for frame in detect_frames
+            ]
+        
+        if scale >= 1:
+            return [list(face_locations) for face_locations in batched_locations]
+        
+        results = []
+        for rgb_frame, face_locations in zip(rgb_frames, batched_locations):
+            height, width = rgb_frame.shape[:2]
+            results.append([
+                (
+                    max(int(top / scale), 0),
+                    min(int(right / scale), width),
+                    min(int(bottom / scale), height),
+                    max(int(left / scale), 0)
+                )
+                for top, right, bottom, left in face_locations
+            ])
+        return results
+    
+    def locate_faces(self, rgb_frame, scale=1.0):
+        """
+        Detect faces, optionally on a downscaled copy of the frame
+        Returns: list of (top, right, bottom, left) tuples in full-frame coordinates
+        """
+        return self.locate_faces_in_frames([rgb_frame], scale=scale)[0]
+    
+    def _encode_faces(self, rgb_frame, face_locations):
+        """
+        Encode all located faces with a single batched dlib ResNet call
+        face_recognition.face_encodings runs one forward pass per face instead
+        Returns: (M, 128) float32 array of face encodings
+        """
+        # Same 5-point landmarks as face_recognition.face_encodings uses by default
+        face_shapes = dlib.full_object_detections()
+        for top, right, bottom, left in face_locations:
+            face_shapes.append(face_recognition.api.pose_predictor_5_point(
+                rgb_frame, dlib.rectangle(left, top, right, bottom)
+            ))
+        
+        descriptors = face_recognition.api.face_encoder.compute_face_descriptor(rgb_frame, face_shapes, 1)
+        return np.array([np.array(descriptor) for descriptor in descriptors], dtype=np.float32)
+    
+    def _match_faces(self, rgb_frame, face_locations, known_encodings, known_student_ids):
+        """
+        Encode the located faces and match them against known faces in one search
+        Returns: list of (student_id, confidence_score) tuples, one per recognized student
+        """
+        if len(face_locations) == 0:
+            return []
+        
+        face_encodings = self._encode_faces(rgb_frame, face_locations)
+        distances, indices = known_encodings.search(face_encodings)
+        
+        matches = {}
+        for distance, index in zip(distances, indices):
+            if index < 0 or distance > self.tolerance:
+                continue
+            student_id = known_student_ids[index]
+            confidence = 1 - float(distance)
+            if confidence > matches.get(student_id, 0):
+                matches[student_id] = confidence
+        
+        return list(matches.items())
+    
+    def recognize_faces_in_frames(self, frames, known_encodings, known_student_ids, detect_scale=1.0):
+        """
+        Recognize every face in one or more video frames
+        detect_scale: run face detection on the frames downscaled by this factor
+        Returns: list of (student_id, confidence_score) tuple lists, one per frame
         """
         try:
+            if not isinstance(known_encodings, FaceIndex):
+                known_encodings = FaceIndex(known_encodings)
+            
+            if len(known_encodings) == 0:
+                return [[] for _ in frames]
+            
             # Convert BGR to RGB
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            rgb_frames = [self._to_rgb(frame) for frame in frames]
             
-            # Find faces in the frame
-            face_locations = face_recognition.face_locations(rgb_frame, model=self.model)
-            face_encodings = face_recognition.face_encodings(rgb_frame, face_locations)
+            # Find all faces, then encode and match them per frame
+            batched_locations = self.locate_faces_in_frames(rgb_frames, scale=detect_scale)
             
-            if len(face_encodings) == 0:
-                return None, None
+            return [
+                self._match_faces(rgb_frame, face_locations, known_encodings, known_student_ids)
+                for rgb_frame, face_locations in zip(rgb_frames, batched_locations)
+            ]
             
-            # Compare with known faces (use first detected face)
-            face_encoding = face_encodings[0]
-            face_distances = face_recognition.face_distance(known_encodings, face_encoding)
+        except Exception as e:
+            print(f"Error recognizing face: {str(e)}")
+            return [[] for _ in frames]
+    
+    def recognize_face_from_frame(self, frame, known_encodings, known_student_ids, detect_scale=1.0):
+        """
+        Recognize the best matching face in a video frame
+        detect_scale: run face detection on the frame downscaled by this factor
+        Returns: tuple of (student_id, confidence_score, face_locations),
+                 student_id and confidence_score are None when nobody matched
+        """
+        try:
+            if not isinstance(known_encodings, FaceIndex):
+                known_encodings = FaceIndex(known_encodings)
             
-            if len(face_distances) > 0:
-                best_match_index = np.argmin(face_distances)
-                confidence = 1 - face_distances[best_match_index]
-                
-                if face_distances[best_match_index] <= self.tolerance:
-                    return known_student_ids[best_match_index], confidence
+            rgb_frame = self._to_rgb(frame)
+            face_locations = self.locate_faces(rgb_frame, scale=detect_scale)
             
-            return None, None
+            matches = []
+            if len(known_encodings) > 0 and face_locations:
+                matches = self._match_faces(rgb_frame, face_locations, known_encodings, known_student_ids)
             
         except Exception as e:
             print(f"Error recognizing face: {str(e)}")
-            return None, None
+            return None, None, []
+        
+        if matches:
+            student_id, confidence = max(matches, key=lambda match: match[1])
+            return student_id, confidence, face_locations
+        return None, None, face_locations
     
     def mark_attendance(self, session, student_id, confidence, frame=None):
         """
         Mark student as present in the session
-        Returns: SessionLog object or None
+        Returns: True if the student was marked present
         """
         try:
-            student = Student.objects.get(student_id=student_id)
-            session_log, created = SessionLog.objects.get_or_create(
-                session=session,
-                student=student,
-                defaults={'status': 'absent'}
+            # student_id is the Student primary key and comes from load_known_faces,
+            # so the log is updated in place without loading the student or the log
+            updated = SessionLog.objects.filter(session=session, student_id=student_id).update(
+                status='present',
+                recognized_at=timezone.now(),
+                confidence_score=confidence,
+                updated_at=timezone.now()
             )
+            if not updated:
+                # Enrolled after the session was created, so it has no log yet
+                session_log, created = SessionLog.objects.get_or_create(
+                    session=session,
+                    student_id=student_id,
+                    defaults={'status': 'absent'}
+                )
+                session_log.mark_present(confidence=confidence)
             
-            # Save captured frame if provided
+            # Encode and store the captured frame off the recognition path
             if frame is not None:
-                success, buffer = cv2.imencode('.jpg', frame)
-                if success:
-                    image_file = ContentFile(buffer.tobytes())
-                    session_log.recognized_image.save(
-                        f"{student_id}_{timezone.now().strftime('%Y%m%d_%H%M%S')}.jpg",
-                        image_file,
-                        save=False
-                    )
+                self._io_pool.submit(self._save_recognized_image, session.id, student_id, frame.copy())
             
-            session_log.mark_present(confidence=confidence)
-            return session_log
+            return True
             
-        except Student.DoesNotExist:
-            print(f"Student {student_id} not found")
-            return None
         except Exception as e:
             print(f"Error marking attendance: {str(e)}")
-            return None
+            return False
+    
+    def _save_recognized_image(self, session_id, student_id, frame):
+        """
+        JPEG-encode a recognized frame and attach it to the student's session log
+        Runs on the background I/O pool
+        """
+        try:
+            if turbo_jpeg is not None:
+                jpeg_data = turbo_jpeg.encode(frame, quality=self.jpeg_quality)
+            else:
+                success, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+                if not success:
+                    return
+                jpeg_data = buffer.tobytes()
+            
+            field = SessionLog._meta.get_field('recognized_image')
+            filename = field.generate_filename(None, f"{student_id}_{timezone.now().strftime('%Y%m%d_%H%M%S')}.jpg")
+            name = field.storage.save(filename, ContentFile(jpeg_data))
+            SessionLog.objects.filter(session_id=session_id, student_id=student_id).update(recognized_image=name)
+        except Exception as e:
+            print(f"Error saving recognized image for {student_id}: {str(e)}")
+        finally:
+            close_old_connections()
     
     def initialize_session_logs(self, session):
         """
         Create session logs for all active students (initially marked as absent)
         """
-        students = Student.objects.filter(is_active=True)
-        session_logs = []
+        student_ids = Student.objects.filter(is_active=True).values_list('pk', flat=True)
         
-        for student in students:
-            log, created = SessionLog.objects.get_or_create(
-                session=session,
-                student=student,
-                defaults={'status': 'absent'}
-            )
-            session_logs.append(log)
+        SessionLog.objects.bulk_create(
+            [SessionLog(session=session, student_id=student_id, status='absent') for student_id in student_ids],
+            ignore_conflicts=True,
+            batch_size=1000
+        )
         
-        return session_logs
+        return list(session.session_logs.all())
+    
+    def start_video_stream(self, session, video_source=0):
+        """
+        Run process_video_stream for the session on the background stream workers
+        Returns: dict with success status and an error message if it was not started
+        """
+        with self._streams_lock:
+            if session.id in self._streams:
+                return {'success': False, 'error': 'Face recognition is already running for this session'}
+            # Never queue behind another session's camera loop, which can last a whole class
+            if len(self._streams) >= self._stream_workers:
+                return {'success': False, 'error': 'All face recognition workers are busy, try again later'}
+            
+            # Registered before submitting, so stop_video_stream can reach the stream straight away
+            stop_event = threading.Event()
+            self._stop_events[session.id] = stop_event
+            future = self._stream_pool.submit(self._run_video_stream, session, video_source, stop_event)
+            self._streams[session.id] = future
+        
+        future.add_done_callback(lambda done, session_id=session.id: self._forget_stream(session_id, done))
+        return {'success': True}
+    
+    @classmethod
+    def _forget_stream(cls, session_id, future):
+        """Drop a finished or cancelled stream's bookkeeping"""
+        with cls._streams_lock:
+            if cls._streams.get(session_id) is future:
+                del cls._streams[session_id]
+                cls._stop_events.pop(session_id, None)
+    
+    def _run_video_stream(self, session, video_source, stop_event):
+        """Stream worker entry point, releases the thread's DB connection when done"""
+        try:
+            self.process_video_stream(session, video_source, stop_event=stop_event)
+        except Exception as e:
+            print(f"Error processing video stream for session {session.id}: {str(e)}")
+        finally:
+            close_old_connections()
     
-    def process_video_stream(self, session, video_source=0):
+    def process_video_stream(self, session, video_source=0, preview=False, stop_event=None):
         """
         Process video stream for face recognition
         video_source: 0 for webcam, or path to video file
+        preview: show the frames in a local window (needs a display)
+        stop_event: threading.Event that ends the stream, registered for the session if not given
         """
         # Load known faces
         known_encodings, known_student_ids = self.load_known_faces()
@@ -204,37 +624,165 @@ class FaceRecognitionService:
         
         # Dictionary to track recognized students
         recognized_students = set()
+        frame_idx = 0
+        
+        # Frames are detected in batches on CUDA, one at a time otherwise
+        batch_size = self.batch_size if self.model == 'cnn' else 1
+        pending_frames = []
+        pending_since = None  # When the oldest pending frame was queued
+        last_gray = None
+        
+        if stop_event is None:
+            stop_event = threading.Event()
+            self._stop_events[session.id] = stop_event
+        
+        # Decode frames on a separate thread so capture overlaps recognition.
+        # Live cameras keep only the newest frame, video files are read in full.
+        frames = queue.Queue(maxsize=1)
+        drop_stale = not (isinstance(video_source, str) and os.path.isfile(video_source))
+        reader = threading.Thread(
+            target=self._read_frames,
+            args=(cap, frames, stop_event, drop_stale),
+            daemon=True
+        )
+        reader.start()
         
         print(f"Starting face recognition for session: {session.session_name}")
         
+        last_refresh = time.monotonic()
+        
         try:
-            while session.is_active():
-                ret, frame = cap.read()
-                if not ret:
-                    break
+            while session.is_active() and not stop_event.is_set():
+                # Pick up status changes made elsewhere about once a second, not per frame
+                if time.monotonic() - last_refresh > 1.0:
+                    session.refresh_from_db(fields=['status', 'end_time'])
+                    last_refresh = time.monotonic()
                 
-                # Process every frame (can be optimized to process every nth frame)
-                student_id, confidence = self.recognize_face_from_frame(
-                    frame, known_encodings, known_student_ids
-                )
+                try:
+                    frame = frames.get(timeout=0.5)
+                except queue.Empty:
+                    # No new frame, but a partial batch may be due
+                    frame = None
+                else:
+                    if frame is None:
+                        break
+                    
+                    # Only run recognition on every Nth frame, and only if the scene changed
+                    if frame_idx % self.frame_stride == 0:
+                        small_gray = cv2.resize(
+                            cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (160, 120), interpolation=cv2.INTER_AREA
+                        )
+                        # Compare with the last frame that was checked, so slow changes still add up
+                        if last_gray is None or cv2.absdiff(small_gray, last_gray).mean() >= self.motion_threshold:
+                            last_gray = small_gray
+                            if not pending_frames:
+                                pending_since = time.monotonic()
+                            pending_frames.append(frame)
+                    frame_idx += 1
                 
-                if student_id and student_id not in recognized_students:
-                    # Mark attendance
-                    session_log = self.mark_attendance(session, student_id, confidence, frame)
-                    if session_log:
-                        recognized_students.add(student_id)
-                        print(f"Marked {student_id} as present (confidence: {confidence:.2f})")
+                # Recognize a full batch, or a partial one whose oldest frame has waited too long,
+                # so a few motion frames in a still classroom don't wait for a full batch
+                if pending_frames and (
+                    len(pending_frames) >= batch_size
+                    or time.monotonic() - pending_since >= self.max_batch_delay
+                ):
+                    self._recognize_pending_frames(
+                        session, pending_frames, known_encodings, known_student_ids, recognized_students
+                    )
+                    pending_frames = []
+                
+                if preview and frame is not None:
+                    cv2.imshow('Attendance System', frame)
+                    
+                    # Break on 'q' key
+                    if cv2.waitKey(1) & 0xFF == ord('q'):
+                        break
+            
+            # Recognize a final partial batch instead of dropping it
+            if pending_frames:
+                self._recognize_pending_frames(
+                    session, pending_frames, known_encodings, known_student_ids, recognized_students
+                )
+        
+        finally:
+            if self._stop_events.get(session.id) is stop_event:
+                del self._stop_events[session.id]
+            stop_event.set()
+            # The reader releases the capture itself once its current read returns,
+            # so a stalled camera read never has the capture released underneath it
+            reader.join(timeout=1.0)
+            if preview:
+                cv2.destroyAllWindows()
+    
+    def _recognize_pending_frames(self, session, frames, known_encodings, known_student_ids, recognized_students):
+        """
+        Recognize a batch of video frames and mark newly recognized students present
+        recognized_students: set of student ids already marked, updated in place
+        """
+        batched_matches = self.recognize_faces_in_frames(
+            frames, known_encodings, known_student_ids, detect_scale=self.detect_scale
+        )
+        
+        for matched_frame, matches in zip(frames, batched_matches):
+            for student_id, confidence in matches:
+                if student_id in recognized_students:
+                    continue
+                # Mark attendance
+                if self.mark_attendance(session, student_id, confidence, matched_frame):
+                    recognized_students.add(student_id)
+                    print(f"Marked {student_id} as present (confidence: {confidence:.2f})")
+    
+    def _read_frames(self, cap, frames, stop_event, drop_stale=True):
+        """
+        Read frames from the capture into a single-slot queue until stopped
+        drop_stale: replace a frame that was not consumed yet instead of waiting
+        Puts None once the source is exhausted, and releases the capture when done
+        """
+        try:
+            while not stop_event.is_set():
+                ret, frame = cap.read()
+                item = frame if ret else None
                 
-                # Display frame (optional, remove for production)
-                cv2.imshow('Attendance System', frame)
+                if drop_stale:
+                    try:
+                        frames.put_nowait(item)
+                    except queue.Full:
+                        # Only this thread puts, so the slot is free after taking the old frame
+                        try:
+                            frames.get_nowait()
+                        except queue.Empty:
+                            pass
+                        frames.put_nowait(item)
+                else:
+                    while not stop_event.is_set():
+                        try:
+                            frames.put(item, timeout=0.5)
+                            break
+                        except queue.Full:
+                            continue
                 
-                # Break on 'q' key
-                if cv2.waitKey(1) & 0xFF == ord('q'):
+                if not ret:
                     break
-                    
         finally:
             cap.release()
-            cv2.destroyAllWindows()
+    
+    @classmethod
+    def stop_video_stream(cls, session_id):
+        """
+        Ask a running or queued process_video_stream for the session to stop
+        Returns: True if a stream was signalled
+        """
+        with cls._streams_lock:
+            stop_event = cls._stop_events.get(session_id)
+            future = cls._streams.get(session_id)
+        
+        # A stream still waiting for a worker never runs
+        if future is not None:
+            future.cancel()
+        if stop_event is None:
+            return False
+        stop_event.set()
+        return True
     
     def capture_multi_angle_images(self, video_source=0):
         """
@@ -0,0 +1,42 @@
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from django.core.cache import cache
+from .models import Student, FaceImage, AttendanceSession, RECENT_SESSIONS_CACHE_KEY
+
+
+@receiver([post_save, post_delete], sender=FaceImage)
+def invalidate_face_image_encodings(sender, instance, **kwargs):
+    """Drop cached encodings for the course the face image belongs to"""
+    # Imported lazily so loading the app does not pull in dlib/OpenCV
+    from .services.face_recognition_service import FaceRecognitionService
+    # The student may already be gone when deleted in cascade, in which case
+    # course_code is None and every cached course is dropped
+    course_code = Student.objects.filter(pk=instance.student_id).values_list('course_id', flat=True).first()
+    FaceRecognitionService.invalidate_known_faces(course_code)
+
+
+@receiver(pre_save, sender=Student)
+def remember_student_course(sender, instance, **kwargs):
+    """Keep the stored course, so moving a student invalidates both courses"""
+    if instance._state.adding:
+        return
+    instance._previous_course_id = Student.objects.filter(pk=instance.pk).values_list('course_id', flat=True).first()
+
+
+@receiver([post_save, post_delete], sender=Student)
+def invalidate_student_encodings(sender, instance, created=False, **kwargs):
+    """A student's name, course or active flag may have changed, drop their course's cached faces"""
+    if created:
+        # A new student has no face images yet, saving those invalidates the course
+        return
+    from .services.face_recognition_service import FaceRecognitionService
+    FaceRecognitionService.invalidate_known_faces(instance.course_id)
+    previous_course_id = getattr(instance, '_previous_course_id', None)
+    if previous_course_id and previous_course_id != instance.course_id:
+        FaceRecognitionService.invalidate_known_faces(previous_course_id)
+
+
+@receiver([post_save, post_delete], sender=AttendanceSession)
+def invalidate_recent_sessions(sender, instance, **kwargs):
+    """Drop the dashboard's cached recent sessions list"""
+    cache.delete(RECENT_SESSIONS_CACHE_KEY)
@@ -1,3 +1,207 @@
-from django.test import TestCase
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock, skipIf
 
-# Create your tests here.
+import numpy as np
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, SimpleTestCase, override_settings
+
+from .models import Course, Student, FaceImage
+from .services import face_index
+from .services.face_index import FaceIndex, ENCODING_DIM, encoding_to_bytes
+
+try:
+    from .services.face_recognition_service import FaceRecognitionService
+except ImportError:  # dlib, face_recognition or OpenCV missing
+    FaceRecognitionService = None
+
+
+def random_encodings(count, seed=0):
+    """Encodings spread like dlib's, components roughly in [-0.25, 0.25]"""
+    return np.random.default_rng(seed).uniform(-0.25, 0.25, (count, ENCODING_DIM)).astype(np.float32)
+
+
+class FaceIndexSearchTests(SimpleTestCase):
+    """FaceIndex.search must agree with a brute-force nearest neighbour on every backend"""
+
+    def setUp(self):
+        self.known = random_encodings(200, seed=1)
+        self.queries = random_encodings(25, seed=2)
+
+    def assert_matches_brute_force(self, index):
+        distances, indices = index.search(self.queries)
+
+        expected = np.linalg.norm(self.known[np.newaxis, :, :] - self.queries[:, np.newaxis, :], axis=2)
+        np.testing.assert_array_equal(indices, expected.argmin(axis=1))
+        np.testing.assert_allclose(distances, expected.min(axis=1), rtol=1e-4, atol=1e-5)
+
+    @skipIf(face_index.faiss is None, "faiss is not installed")
+    def test_faiss_search(self):
+        index = FaceIndex(self.known)
+        self.assertIsNotNone(index.index)
+        self.assert_matches_brute_force(index)
+
+    @skipIf(face_index.numba is None, "numba is not installed")
+    def test_numba_search(self):
+        with mock.patch.object(face_index, 'faiss', None):
+            index = FaceIndex(self.known)
+            self.assertIsNone(index.index)
+            self.assert_matches_brute_force(index)
+
+    def test_numpy_search(self):
+        with mock.patch.object(face_index, 'faiss', None), mock.patch.object(face_index, 'numba', None):
+            index = FaceIndex(self.known)
+            self.assert_matches_brute_force(index)
+
+    def test_search_single_query(self):
+        index = FaceIndex(self.known)
+        distances, indices = index.search(self.known[7])
+        self.assertEqual(list(indices), [7])
+        self.assertAlmostEqual(float(distances[0]), 0.0, places=3)
+
+    def test_encoding_round_trip(self):
+        stored = [encoding_to_bytes(encoding) for encoding in self.known[:3]]
+        decoded = face_index.encodings_from_bytes(stored)
+        self.assertEqual(decoded.dtype, np.float32)
+        np.testing.assert_allclose(decoded, self.known[:3], atol=1e-3)
+
+
+@skipIf(FaceRecognitionService is None, "face recognition dependencies are not installed")
+class KnownFacesCacheTests(TestCase):
+    """load_known_faces must pick up every change that invalidates a course"""
+
+    def setUp(self):
+        self.index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.index_dir, ignore_errors=True)
+        # A file-based cache shared like in production, in a directory of its own
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir, ignore_errors=True)
+        settings_override = override_settings(
+            FACE_INDEX_DIR=self.index_dir,
+            CACHES={
+                'default': {
+                    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                    'LOCATION': cache_dir,
+                }
+            }
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        cache.clear()
+        FaceRecognitionService._encoding_cache.clear()
+        FaceRecognitionService._names_cache.clear()
+
+        self.course = Course.objects.create(code='BIT', name='Business Information Technology')
+        self.other_course = Course.objects.create(code='BA', name='Business Administration')
+        self.encodings = random_encodings(4, seed=3)
+        self.service = FaceRecognitionService()
+
+    def enroll(self, number, face_encoding=None, course=None):
+        student = Student.objects.create(
+            student_id=f's{number}',
+            first_name='Student',
+            last_name=str(number),
+            email=f's{number}@example.com',
+            course=course or self.course
+        )
+        FaceImage.objects.create(
+            student=student,
+            angle='front',
+            image=f'face_images/s{number}/front.jpg',
+            face_encoding=face_encoding or encoding_to_bytes(self.encodings[number])
+        )
+        return student
+
+    def known_ids(self, course=None):
+        return sorted(self.service.load_known_faces(course=course or self.course)[1])
+
+    def test_load_known_faces(self):
+        self.enroll(0)
+        self.enroll(1)
+        known, ids = self.service.load_known_faces(course=self.course)
+        self.assertEqual(len(known), 2)
+        self.assertEqual(sorted(ids), ['s0', 's1'])
+
+    def test_load_is_cached(self):
+        self.enroll(0)
+        first = self.service.load_known_faces(course=self.course)
+        self.assertIs(self.service.load_known_faces(course=self.course), first)
+
+    def test_reload_after_enrollment(self):
+        self.enroll(0)
+        self.assertEqual(self.known_ids(), ['s0'])
+        self.enroll(1)
+        self.assertEqual(self.known_ids(), ['s0', 's1'])
+
+    def test_reload_after_convert_face_encodings(self):
+        self.enroll(0)
+        self.enroll(1)
+        # Legacy float32 blob, skipped until converted
+        self.enroll(2, face_encoding=self.encodings[2].tobytes())
+        self.assertEqual(self.known_ids(), ['s0', 's1'])
+
+        call_command('convert_face_encodings', stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(self.known_ids(), ['s0', 's1', 's2'])
+
+    def test_reload_after_deactivation(self):
+        student = self.enroll(0)
+        self.enroll(1)
+        self.assertEqual(self.known_ids(), ['s0', 's1'])
+
+        student.is_active = False
+        student.save()
+        self.assertEqual(self.known_ids(), ['s1'])
+
+    def test_reload_after_course_change(self):
+        student = self.enroll(0)
+        self.assertEqual(self.known_ids(), ['s0'])
+        self.assertEqual(self.known_ids(self.other_course), [])
+
+        student.course = self.other_course
+        student.save()
+        self.assertEqual(self.known_ids(), [])
+        self.assertEqual(self.known_ids(self.other_course), ['s0'])
+
+    def test_invalidate_reloads_from_database(self):
+        self.enroll(0)
+        self.assertEqual(self.known_ids(), ['s0'])
+
+        # update() sends no signals, so only the explicit invalidation reveals the change
+        FaceImage.objects.filter(student_id='s0').update(is_active=False)
+        FaceRecognitionService.invalidate_known_faces(self.course.code)
+        self.assertEqual(self.known_ids(), [])
+
+    def test_reload_after_invalidation_by_another_worker(self):
+        self.enroll(0)
+        self.assertEqual(self.known_ids(), ['s0'])
+
+        # Another process enrolls a student, only the shared cache version tells this one
+        student = Student.objects.create(
+            student_id='s1', first_name='Student', last_name='1', email='s1@example.com', course=self.course
+        )
+        FaceImage.objects.bulk_create([FaceImage(
+            student=student, angle='front', image='face_images/s1/front.jpg',
+            face_encoding=encoding_to_bytes(self.encodings[1])
+        )])
+        cache.set(f'known_faces_version:{self.course.code}', 'bumped-elsewhere', None)
+        self.assertEqual(self.known_ids(), ['s0', 's1'])
+
+    def test_other_course_is_not_invalidated(self):
+        self.enroll(0)
+        self.enroll(1, course=self.other_course)
+        other = self.service.load_known_faces(course=self.other_course)
+
+        self.enroll(2)
+        self.assertIs(self.service.load_known_faces(course=self.other_course), other)
+        self.assertEqual(self.known_ids(), ['s0', 's2'])
+
+    def test_known_student_names_follow_invalidation(self):
+        student = self.enroll(0)
+        self.assertEqual(self.service.known_student_names(course=self.course), {'s0': 'Student 0'})
+
+        student.first_name = 'Renamed'
+        student.save()
+        self.assertEqual(self.service.known_student_names(course=self.course), {'s0': 'Renamed 0'})
@@ -3,11 +3,38 @@ from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse
 from django.views.decorators.http import require_http_methods
+from django.views.decorators.cache import cache_page
+from django.views.decorators.vary import vary_on_cookie
+from django.core.cache import cache
 from django.utils import timezone
-from django.db.models import Count, Q
-from .models import Student, FaceImage, AttendanceSession, SessionLog, Teacher, Course
+from django.db import transaction
+from django.db.models import Count, Q, OuterRef, Subquery
+from django.core.files.storage import default_storage
+from .models import Student, FaceImage, AttendanceSession, SessionLog, Teacher, Course, RECENT_SESSIONS_CACHE_KEY
 from .services.face_recognition_service import FaceRecognitionService
+from functools import lru_cache
 import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=1)
+def _get_face_service():
+    """Shared FaceRecognitionService, so detector models load once per worker"""
+    return FaceRecognitionService()
+
+
+def _front_image_path_subquery():
+    """Storage path of each logged student's newest active front image, for use in annotate()"""
+    return Subquery(
+        FaceImage.objects.filter(
+            student=OuterRef('student'),
+            angle='front',
+            is_active=True
+        ).order_by('-captured_at').values('image')[:1]
+    )
+
 
 # Authentication Views
 def teacher_login(request):
@@ -45,13 +72,16 @@ def teacher_logout(request):
 @login_required
 def attendance_dashboard(request):
     """Main attendance dashboard for teachers"""
-    try:
-        teacher = Teacher.objects.get(user=request.user)
-    except Teacher.DoesNotExist:
+    teacher = request.teacher
+    if not teacher:
         return redirect('teacher_login')
     
-    # Get recent sessions
-    recent_sessions = AttendanceSession.objects.all()[:10]
+    # Get recent sessions, cached until a session is saved or deleted
+    recent_sessions = cache.get_or_set(
+        RECENT_SESSIONS_CACHE_KEY,
+        lambda: list(AttendanceSession.objects.all()[:10]),
+        30
+    )
     
     # Get active session if any
     active_session = AttendanceSession.objects.filter(
@@ -72,9 +102,8 @@ def attendance_dashboard(request):
 @login_required
 def session_detail(request, session_id):
     """View detailed attendance for a specific session"""
-    try:
-        teacher = Teacher.objects.get(user=request.user)
-    except Teacher.DoesNotExist:
+    teacher = request.teacher
+    if not teacher:
         return redirect('teacher_login')
     
     session = get_object_or_404(AttendanceSession, id=session_id)
@@ -83,26 +112,36 @@ def session_detail(request, session_id):
     stats = session.get_attendance_statistics()
     
     # Get present students with their front face images
-    present_students = SessionLog.objects.filter(
+    present_rows = SessionLog.objects.filter(
         session=session,
         status='present'
-    ).select_related('student').order_by('recognized_at')
-    
-    present_list = []
-    for log in present_students:
-        front_image = log.student.get_front_face_image()
-        present_list.append({
-            'log': log,
-            'student': log.student,
-            'front_image': front_image,
-            'confidence': log.confidence_score
-        })
+    ).values(
+        'student__student_id', 'student__first_name', 'student__last_name',
+        'recognized_at', 'confidence_score'
+    ).annotate(
+        front_image_path=_front_image_path_subquery()
+    ).order_by('recognized_at')
+    
+    present_list = [{
+        'student_id': row['student__student_id'],
+        'name': f"{row['student__first_name']} {row['student__last_name']}",
+        'recognized_at': row['recognized_at'],
+        'confidence': row['confidence_score'],
+        'front_image_url': default_storage.url(row['front_image_path']) if row['front_image_path'] else None
+    } for row in present_rows]
     
     # Get absent students
-    absent_students = SessionLog.objects.filter(
+    absent_rows = SessionLog.objects.filter(
         session=session,
         status='absent'
-    ).select_related('student').order_by('student__last_name', 'student__first_name')
+    ).values(
+        'student__student_id', 'student__first_name', 'student__last_name'
+    ).order_by('student__last_name', 'student__first_name')
+    
+    absent_students = [{
+        'student_id': row['student__student_id'],
+        'name': f"{row['student__first_name']} {row['student__last_name']}"
+    } for row in absent_rows]
     
     context = {
         'teacher': teacher,
@@ -118,9 +157,8 @@ def session_detail(request, session_id):
 @login_required
 def student_verification(request, session_id, student_id):
     """View all angle images for a student for verification purposes"""
-    try:
-        teacher = Teacher.objects.get(user=request.user)
-    except Teacher.DoesNotExist:
+    teacher = request.teacher
+    if not teacher:
         return redirect('teacher_login')
     
     session = get_object_or_404(AttendanceSession, id=session_id)
@@ -147,7 +185,8 @@ def student_verification(request, session_id, student_id):
 def create_session(request):
     """Create a new attendance session"""
     try:
-        teacher = Teacher.objects.get(user=request.user)
+        if not request.teacher:
+            return JsonResponse({'success': False, 'error': 'Teacher account required'}, status=403)
         
         course_code = request.POST.get('course')
         session_name = request.POST.get('session_name')
@@ -164,25 +203,24 @@ def create_session(request):
                 'error': 'Invalid course selected'
             }, status=400)
         
-        session = AttendanceSession.objects.create(
-            session_name=session_name,
-            course=course,
-            session_date=session_date,
-            start_time=start_time,
-            end_time=end_time,
-            created_by=request.user,
-            status='active'
-        )
-        
-        # Initialize session logs for all students IN THIS COURSE
-        face_service = FaceRecognitionService()
-        students = Student.objects.filter(is_active=True, course=course)
-        
-        for student in students:
-            SessionLog.objects.create(
-                session=session,
-                student=student,
-                status='absent'
+        with transaction.atomic():
+            # Initialize session logs for all students IN THIS COURSE
+            students = list(Student.objects.filter(is_active=True, course=course).only('pk'))
+            
+            session = AttendanceSession.objects.create(
+                session_name=session_name,
+                course=course,
+                session_date=session_date,
+                start_time=start_time,
+                end_time=end_time,
+                created_by=request.user,
+                status='active',
+                total_students=len(students)
+            )
+            
+            SessionLog.objects.bulk_create(
+                [SessionLog(session=session, student=student, status='absent') for student in students],
+                batch_size=500
             )
         
         return JsonResponse({
@@ -203,7 +241,8 @@ def create_session(request):
 def start_recognition(request, session_id):
     """Start face recognition for a session"""
     try:
-        teacher = Teacher.objects.get(user=request.user)
+        if not request.teacher:
+            return JsonResponse({'success': False, 'error': 'Teacher account required'}, status=403)
         session = get_object_or_404(AttendanceSession, id=session_id)
         
         if not session.is_active():
@@ -219,18 +258,15 @@ def start_recognition(request, session_id):
         except ValueError:
             pass  # Keep as string if it's a URL or file path
         
-        # Start face recognition in background thread
-        # Note: In production, use Celery or similar for background tasks
-        face_service = FaceRecognitionService()
+        # Start face recognition on the service's background stream workers
+        face_service = _get_face_service()
         
-        # This is a simplified version - in production, run this asynchronously
-        import threading
-        recognition_thread = threading.Thread(
-            target=face_service.process_video_stream,
-            args=(session, camera_source)
-        )
-        recognition_thread.daemon = True
-        recognition_thread.start()
+        result = face_service.start_video_stream(session, camera_source)
+        if not result['success']:
+            return JsonResponse({
+                'success': False,
+                'error': result['error']
+            }, status=400)
         
         return JsonResponse({
             'success': True,
@@ -249,12 +285,16 @@ def start_recognition(request, session_id):
 def end_session(request, session_id):
     """End an attendance session"""
     try:
-        teacher = Teacher.objects.get(user=request.user)
+        if not request.teacher:
+            return JsonResponse({'success': False, 'error': 'Teacher account required'}, status=403)
         session = get_object_or_404(AttendanceSession, id=session_id)
         
         session.status = 'completed'
         session.save()
         
+        # Stop any background recognition still reading the camera
+        FaceRecognitionService.stop_video_stream(session.id)
+        
         return JsonResponse({
             'success': True,
             'message': 'Session ended successfully'
@@ -269,40 +309,44 @@ def end_session(request, session_id):
 
 # Student Management Views
 @login_required
+@cache_page(60)
+@vary_on_cookie
 def students_by_course(request):
     """View students organized by course"""
-    try:
-        teacher = Teacher.objects.get(user=request.user)
-    except Teacher.DoesNotExist:
+    teacher = request.teacher
+    if not teacher:
         return redirect('teacher_login')
     
-    # Get students by course
-    coet_students = Student.objects.filter(course__code='COET', is_active=True).order_by('last_name', 'first_name')
-    bit_students = Student.objects.filter(course__code='BIT', is_active=True).order_by('last_name', 'first_name')
-    ba_students = Student.objects.filter(course__code='BA', is_active=True).order_by('last_name', 'first_name')
+    # Get students by course in one query, then split them per course
+    course_students = {'COET': [], 'BIT': [], 'BA': []}
+    students = Student.objects.filter(
+        course_id__in=course_students.keys(),
+        is_active=True
+    ).order_by('last_name', 'first_name')
+    
+    for student in students:
+        course_students[student.course_id].append(student)
     
     context = {
         'teacher': teacher,
-        'coet_students': coet_students,
-        'bit_students': bit_students,
-        'ba_students': ba_students,
-        'coet_count': coet_students.count(),
-        'bit_count': bit_students.count(),
-        'ba_count': ba_students.count(),
-        'coet_active': coet_students.count(),
-        'bit_active': bit_students.count(),
-        'ba_active': ba_students.count(),
+        'coet_students': course_students['COET'],
+        'bit_students': course_students['BIT'],
+        'ba_students': course_students['BA'],
+        'coet_count': len(course_students['COET']),
+        'bit_count': len(course_students['BIT']),
+        'ba_count': len(course_students['BA']),
     }
     
     return render(request, 'students_by_course.html', context)
 
 
 @login_required
+@cache_page(60)
+@vary_on_cookie
 def student_list(request):
     """List all students"""
-    try:
-        teacher = Teacher.objects.get(user=request.user)
-    except Teacher.DoesNotExist:
+    teacher = request.teacher
+    if not teacher:
         return redirect('teacher_login')
     
     students = Student.objects.filter(is_active=True).order_by('last_name', 'first_name')
@@ -318,9 +362,8 @@ def student_list(request):
 @login_required
 def camera_capture(request):
     """Camera capture page for student enrollment"""
-    try:
-        teacher = Teacher.objects.get(user=request.user)
-    except Teacher.DoesNotExist:
+    teacher = request.teacher
+    if not teacher:
         return redirect('teacher_login')
     
     context = {
@@ -333,9 +376,8 @@ def camera_capture(request):
 @login_required
 def enroll_student(request):
     """Enroll a new student with face images"""
-    try:
-        teacher = Teacher.objects.get(user=request.user)
-    except Teacher.DoesNotExist:
+    teacher = request.teacher
+    if not teacher:
         return redirect('teacher_login')
     
     if request.method == 'POST':
@@ -346,8 +388,10 @@ def enroll_student(request):
             email = request.POST.get('email')
             course_code = request.POST.get('course')
             
-            # Debug logging
-            print(f"DEBUG: Received data - ID: {student_id}, Name: {first_name} {last_name}, Email: {email}, Course: {course_code}")
+            logger.debug(
+                "Enrollment received - ID: %s, Name: %s %s, Email: %s, Course: %s",
+                student_id, first_name, last_name, email, course_code
+            )
             
             # Validate required fields
             if not all([student_id, first_name, last_name, email, course_code]):
@@ -388,14 +432,14 @@ def enroll_student(request):
                 course=course
             )
             
-            print(f"DEBUG: Student created: {student}")
+            logger.debug("Student created: %s", student.student_id)
             
             # Get uploaded images
             front_image = request.FILES.get('front_image')
             left_image = request.FILES.get('left_image')
             right_image = request.FILES.get('right_image')
             
-            print(f"DEBUG: Images received - Front: {front_image}, Left: {left_image}, Right: {right_image}")
+            logger.debug("Images received - Front: %s, Left: %s, Right: %s", front_image, left_image, right_image)
             
             if not all([front_image, left_image, right_image]):
                 student.delete()
@@ -410,12 +454,12 @@ def enroll_student(request):
                 }, status=400)
             
             # Save face images
-            face_service = FaceRecognitionService()
+            face_service = _get_face_service()
             result = face_service.save_student_face_images(
                 student, front_image, left_image, right_image
             )
             
-            print(f"DEBUG: Face save result: {result}")
+            logger.debug("Face save result for %s: %s", student.student_id, result)
             
             if result['success']:
                 return JsonResponse({
@@ -431,9 +475,7 @@ def enroll_student(request):
                 }, status=400)
         
         except Exception as e:
-            print(f"ERROR in enroll_student: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("enroll_student failed")
             return JsonResponse({
                 'success': False,
                 'error': f'Server error: {str(e)}'
@@ -449,18 +491,16 @@ def enroll_student(request):
 @login_required
 def live_attendance_session(request, session_id):
     """Live attendance session with camera"""
-    try:
-        teacher = Teacher.objects.get(user=request.user)
-    except Teacher.DoesNotExist:
+    teacher = request.teacher
+    if not teacher:
         return redirect('teacher_login')
     
     session = get_object_or_404(AttendanceSession, id=session_id)
-    total_students = Student.objects.filter(is_active=True, course=session.course).count()
     
     context = {
         'teacher': teacher,
         'session': session,
-        'total_students': total_students
+        'total_students': session.total_students
     }
     
     return render(request, 'live_attendance.html', context)
@@ -470,13 +510,20 @@ def live_attendance_session(request, session_id):
 def recognize_face_api(request):
     """API endpoint for real-time face recognition"""
     try:
-        if 'image' not in request.FILES:
+        if request.content_type in ('application/octet-stream', 'image/jpeg'):
+            # Raw frame bytes in the body, session ID in the query string, no multipart parsing
+            image_bytes = request.body
+            session_id = request.GET.get('session_id')
+        else:
+            image_bytes = request.FILES['image'].read() if 'image' in request.FILES else b''
+            session_id = request.POST.get('session_id')
+        
+        if not image_bytes:
             return JsonResponse({
                 'success': False,
                 'error': 'No image provided'
             })
         
-        session_id = request.POST.get('session_id')
         if not session_id:
             return JsonResponse({
                 'success': False,
@@ -484,92 +531,71 @@ def recognize_face_api(request):
             })
         
         session = get_object_or_404(AttendanceSession, id=session_id)
-        image_file = request.FILES['image']
         
-        # Save temporary file
-        import tempfile
-        import os
+        # Initialize face recognition service
+        face_service = _get_face_service()
         
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_file:
-            for chunk in image_file.chunks():
-                temp_file.write(chunk)
-            temp_path = temp_file.name
+        # Load known faces from the session's course ONLY
+        known_encodings, known_student_ids = face_service.load_known_faces(course=session.course)
         
-        try:
-            # Initialize face recognition service
-            face_service = FaceRecognitionService()
-            
-            # Load known faces from the session's course ONLY
-            known_encodings, known_student_ids = face_service.load_known_faces(course=session.course)
-            
-            if len(known_encodings) == 0:
+        if len(known_encodings) == 0:
+            return JsonResponse({
+                'success': False,
+                'error': f'No enrolled students found for {session.course.code}',
+                'faces_detected': 0
+            })
+        
+        # Decode the uploaded image in memory
+        import cv2
+        import numpy as np
+        
+        frame = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            return JsonResponse({
+                'success': False,
+                'error': 'Could not read image',
+                'faces_detected': 0
+            })
+        
+        # Detect on a copy no larger than 640px, boxes come back in full-frame coordinates
+        detect_scale = min(1.0, 640.0 / max(frame.shape[:2]))
+        
+        # Recognize face, reusing the detected locations to count faces
+        student_id, confidence, face_locations = face_service.recognize_face_from_frame(
+            frame, known_encodings, known_student_ids, detect_scale=detect_scale
+        )
+        faces_detected = len(face_locations)
+        
+        if student_id:
+            # Verify student is in this session's course, from the cached course roster
+            student_name = face_service.known_student_names(course=session.course).get(student_id)
+            if student_name is None:
+                # Student not in this course, ignore
                 return JsonResponse({
-                    'success': False,
-                    'error': f'No enrolled students found for {session.course.code}',
-                    'faces_detected': 0
+                    'success': True,
+                    'student': None,
+                    'faces_detected': faces_detected,
+                    'message': 'Student not enrolled in this course'
                 })
             
-            # Load and process image
-            import face_recognition
-            import cv2
-            
-            frame = cv2.imread(temp_path)
-            if frame is None:
+            # Mark attendance
+            if face_service.mark_attendance(session, student_id, confidence, frame):
                 return JsonResponse({
-                    'success': False,
-                    'error': 'Could not read image',
-                    'faces_detected': 0
+                    'success': True,
+                    'student': {
+                        'student_id': student_id,
+                        'name': student_name,
+                        'confidence': confidence,
+                        'course': session.course.code
+                    },
+                    'faces_detected': faces_detected
                 })
-            
-            # Recognize face
-            student_id, confidence = face_service.recognize_face_from_frame(
-                frame, known_encodings, known_student_ids
-            )
-            
-            # Count faces in frame
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            face_locations = face_recognition.face_locations(rgb_frame)
-            faces_detected = len(face_locations)
-            
-            if student_id:
-                # Verify student is in this session's course
-                student = Student.objects.get(student_id=student_id)
-                if student.course != session.course:
-                    # Student not in this course, ignore
-                    return JsonResponse({
-                        'success': True,
-                        'student': None,
-                        'faces_detected': faces_detected,
-                        'message': 'Student not enrolled in this course'
-                    })
-                
-                # Mark attendance
-                session_log = face_service.mark_attendance(
-                    session, student_id, confidence, frame
-                )
-                
-                if session_log:
-                    return JsonResponse({
-                        'success': True,
-                        'student': {
-                            'student_id': student_id,
-                            'name': student.full_name,
-                            'confidence': confidence,
-                            'course': student.course.code
-                        },
-                        'faces_detected': faces_detected
-                    })
-            
-            return JsonResponse({
-                'success': True,
-                'student': None,
-                'faces_detected': faces_detected
-            })
-            
-        finally:
-            # Clean up temp file
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
+        
+        return JsonResponse({
+            'success': True,
+            'student': None,
+            'faces_detected': faces_detected
+        })
     
     except Exception as e:
         return JsonResponse({
@@ -597,21 +623,23 @@ def get_present_students(request, session_id):
     """Get list of present students for a session"""
     session = get_object_or_404(AttendanceSession, id=session_id)
     
-    present_students = SessionLog.objects.filter(
+    present_rows = SessionLog.objects.filter(
         session=session,
         status='present'
-    ).select_related('student').order_by('-recognized_at')
-    
-    students_data = []
-    for log in present_students:
-        front_image = log.student.get_front_face_image()
-        students_data.append({
-            'student_id': log.student.student_id,
-            'name': log.student.full_name,
-            'recognized_at': log.recognized_at.strftime('%Y-%m-%d %H:%M:%S'),
-            'confidence': log.confidence_score,
-            'front_image_url': front_image.image.url if front_image else None
-        })
+    ).values(
+        'student__student_id', 'student__first_name', 'student__last_name',
+        'recognized_at', 'confidence_score'
+    ).annotate(
+        front_image_path=_front_image_path_subquery()
+    ).order_by('-recognized_at')
+    
+    students_data = [{
+        'student_id': row['student__student_id'],
+        'name': f"{row['student__first_name']} {row['student__last_name']}",
+        'recognized_at': row['recognized_at'].strftime('%Y-%m-%d %H:%M:%S'),
+        'confidence': row['confidence_score'],
+        'front_image_url': default_storage.url(row['front_image_path']) if row['front_image_path'] else None
+    } for row in present_rows]
     
     return JsonResponse({
         'success': True,